@@ -198,7 +198,6 @@ class GenericCompositeMapper(NWBGeppettoMapper):
                 for index in range(value.data.shape[1]):  # loop through data rows to make separate variables
                     name = f"{self.sanitize(key)}_row{index:02}"  # pad row name so ordered correctly in list view
                     variable = supportingmapper.create_variable(name, value, pynwb_obj)
-                    self.created_variables[id(value.data[:, index])] = variable
                     obj_type.variables.append(variable)
             elif is_multidimensional_data(pynwb_obj) and key == 'data':
                 continue  # create data variable in TimeSeriesMapper.modify_type instead
@@ -338,7 +337,10 @@ class TimeseriesMapper(GenericCompositeMapper):
 
         if is_multidimensional_data(pynwb_obj):  # if multidimensional data, select data from relevant row
             index = self.type_ids[pynwb_obj.name]
-            timeseries_dict = {**pynwb_obj.fields, 'data': pynwb_obj.data[:, index]}
+            if index >= pynwb_obj.data.shape[1]:
+                raise IndexError(f"{pynwb_obj.name} has no row {index}")
+            # The row values are read only when imported, all the rows sharing a single read of the data
+            timeseries_dict = {**pynwb_obj.fields, 'time_series': pynwb_obj, 'row': index}
             import_val = ImportValueMapper.create_import_value(timeseries_dict)
             variable = self.model_factory.create_state_variable(id="data", initialValue=import_val)
             geppetto_composite_type.variables.append(variable)
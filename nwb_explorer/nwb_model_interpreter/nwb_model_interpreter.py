@@ -88,41 +88,38 @@ class NWBModelInterpreter(ModelInterpreter):
             if var_to_extract in ['time', 'timestamps']:
                 timestamps = NWBReader.get_timeseries_timestamps(time_series)
                 if time_series.rate is not None:
-                    for index, item in enumerate(timestamps):
-                        timestamps[index] = (
-                            timestamps[index] / time_series.rate / time_series.rate) + time_series.starting_time
+                    # timestamps is a fresh array from the reader, so it can be updated in place
+                    timestamps /= time_series.rate
+                    timestamps /= time_series.rate
+                    timestamps += time_series.starting_time
                 timestamps_unit = guess_units(time_series.timestamps_unit) if hasattr(time_series,
                                                                                       'timestamps_unit') and time_series.timestamps_unit else 's'
-                return GeppettoModelFactory.create_time_series(timestamps, timestamps_unit)
+                return GeppettoModelFactory.create_time_series(timestamps.tolist(), timestamps_unit)
             else:
 
                 plottable_timeseries = NWBReader.get_plottable_timeseries(
                     time_series)
 
                 unit = guess_units(time_series.unit)
-                time_series_value = GeppettoModelFactory.create_time_series(
-                    plottable_timeseries and plottable_timeseries[0], unit)
-                if time_series.conversion is not None:
-                    for index, item in enumerate(time_series_value.value):
-                        time_series_value.value[index] = time_series_value.value[index] * \
-                            time_series.conversion
-                stringV = str(time_series_value)
-                return time_series_value
+                return self.create_time_series_value(plottable_timeseries, unit, time_series.conversion)
         elif isinstance(nwb_obj, dict):
-            plottable_timeseries = NWBReader.get_mono_dimensional_timeseries_aux(
-                nwb_obj['data'])
+            plottable_timeseries = self.nwb_reader.get_plottable_timeseries_row(
+                nwb_obj['time_series'], nwb_obj['row'])
             unit = guess_units(nwb_obj['unit'])
-            time_series_value = GeppettoModelFactory.create_time_series(
-                plottable_timeseries and plottable_timeseries[0], unit)
-            if nwb_obj['conversion'] is not None:
-                for index, item in enumerate(time_series_value.value):
-                    time_series_value.value[index] = time_series_value.value[index] * \
-                        nwb_obj['conversion']
-            return time_series_value
+            return self.create_time_series_value(plottable_timeseries, unit, nwb_obj['conversion'])
         else:
             # TODO handle other possible ImportValue(s)
             pass
 
+    @staticmethod
+    def create_time_series_value(plottable_timeseries, unit, conversion=None):
+        """Builds a geppetto TimeSeries from the first row of a plottable timeseries array."""
+        values = plottable_timeseries[0] if len(plottable_timeseries) else plottable_timeseries.ravel()
+        if conversion is not None:
+            values = values * conversion
+        # The geppetto model holds plain python floats: convert once, after the numpy work is done
+        return GeppettoModelFactory.create_time_series(values.tolist(), unit)
+
     def getName(self):
         return 'NWB Model Interpreter'
 
@@ -140,3 +137,6 @@ class NWBModelInterpreter(ModelInterpreter):
 
     def get_image(self, name, interface, index):
         return self.nwb_reader.get_image(name, interface, index)
+
+    def clear_cache(self):
+        self.nwb_reader.clear_plottable_cache()
@@ -1,7 +1,11 @@
-from pynwb import NWBHDF5IO
+import h5py
+from h5py import Dataset
+from pynwb import NWBHDF5IO, TimeSeries
 from pynwb.core import NWBDataInterface
 from pynwb.image import ImageSeries
 import base64
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from PIL import Image as Img
 import imageio
@@ -11,6 +15,22 @@ import numpy as np
 
 NWB_ROOT_NAME = 'root'
 
+# Per dataset HDF5 chunk cache. The h5py default (1 MiB) is smaller than most NWB chunks, so every zoom or pan
+# would decompress the same chunks again
+HDF5_CHUNK_CACHE_BYTES = 64 * 1024 * 1024
+HDF5_CHUNK_CACHE_SLOTS = 10007
+
+# Background workers used to prefetch images. h5py serializes the HDF5 calls behind its own lock, so two frames are
+# never read at once: what overlaps is the PNG encoding of a frame (Pillow releases the GIL) with the read of the
+# next one, and both with the caller's work
+IO_PREFETCH_WORKERS = 2
+
+# Upper bound of the memory each reader spends keeping multidimensional plottable arrays around, for their rows to be
+# imported one by one without reading the data again. Half the HDF5 chunk cache: 4M values, e.g. 64 channels of 65536
+# samples. An array is released once all its rows are imported; series not fitting in the room left have each channel
+# read on its own
+PLOTTABLE_CACHE_BYTES = 32 * 1024 * 1024
+
 
 class NWBReader:
     nwb_map_id_api = {'acquisition': 'acquisition',
@@ -21,51 +41,159 @@ class NWBReader:
 
     @staticmethod
     def get_plottable_timeseries(time_series, resampling_size=None):
-
         # TODO we may need to rearrange that when dealing with spatial series: a different type of plot (3D or else)
         #  may me more adequate than what we're doing (i.e. splitting in multiple mono dimensional timeseries)
-        d = time_series.data[::1]
-        if len(time_series.data.shape) == 3 and time_series.data.shape[1] == 1 and time_series.data.shape[2] == 1:
-            d = d.reshape(time_series.data.shape[0])
+        # Dataset metadata lookups go through the HDF5 library each time, so read the shape once
+        data = time_series.data
+        shape = data.shape
+        step = NWBReader._get_resampling_step(shape[0], resampling_size)
+        if len(shape) == 1 and step == 1 and isinstance(data, Dataset) and data.size and data.dtype.kind in 'biuf':
+            # Mono dimensional series are the common case: let HDF5 convert to float while reading straight into
+            # the output row, with no intermediate array in the stored dtype and no transpose
+            time_series_array = np.empty((1, shape[0]), dtype=float)
+            data.read_direct(time_series_array[0])
+            return NWBReader._replace_non_finite(time_series_array, data.dtype)
+        d = NWBReader._read_decimated(data, step, shape)
+        if len(shape) == 3 and shape[1] == 1 and shape[2] == 1:
+            d = d.reshape(d.shape[0])
         time_series_array = NWBReader.get_mono_dimensional_timeseries_aux(d)
         return time_series_array
 
+    def get_plottable_timeseries_row(self, time_series, index, resampling_size=None):
+        """Returns the values of the index-th column of a multidimensional time series, as a one row array."""
+        data = time_series.data
+        shape = data.shape
+        if len(shape) != 2:
+            return NWBReader.get_mono_dimensional_timeseries_aux(data[:, index])
+        key = (id(time_series), resampling_size)
+        if key not in self.__plottable_cache:
+            step = NWBReader._get_resampling_step(shape[0], resampling_size)
+            nbytes = -(-shape[0] // step) * shape[1] * np.dtype(float).itemsize
+            if nbytes > self.__plottable_cache_max_bytes - self.__plottable_cache_bytes:
+                # No room to keep all the channels until they are imported: read only the one asked for, whole, as
+                # strided selections are very slow on HDF5 datasets
+                return NWBReader.get_mono_dimensional_timeseries_aux(data[:, index][::step])
+            time_series_array = NWBReader.get_plottable_timeseries(time_series, resampling_size)
+            time_series_array.setflags(write=False)
+            # The time series is kept with its array so that its id cannot be reused while the entry exists
+            self.__plottable_cache[key] = (time_series, time_series_array, set(range(shape[1])))
+            self.__plottable_cache_bytes += time_series_array.nbytes
+        # Each column is a row of the cached plottable array: the data is read and sanitized once for all the
+        # channels, instead of reading a strided column per channel
+        _, time_series_array, pending_rows = self.__plottable_cache[key]
+        pending_rows.discard(index)
+        if not pending_rows:
+            # Every row has been handed out, so the array is not needed anymore
+            del self.__plottable_cache[key]
+            self.__plottable_cache_bytes -= time_series_array.nbytes
+        return time_series_array[index:index + 1]
+
+    def clear_plottable_cache(self):
+        """Releases the plottable arrays kept for the rows of multidimensional time series not imported yet."""
+        self.__plottable_cache.clear()
+        self.__plottable_cache_bytes = 0
+
     @staticmethod
-    def get_timeseries_timestamps(time_series):
+    def get_timeseries_timestamps(time_series, resampling_size=None):
         if isinstance(time_series, ImageSeries):
             if (time_series.format == "external"):
-                return time_series.timestamps[()].astype(float).tolist()
-        data_size = time_series.data.size
-
+                return time_series.timestamps[()].astype(float)
         if time_series.timestamps is not None:
             timestamps = time_series.timestamps
-            timestamps = timestamps[::].astype(float).tolist()
+            step = NWBReader._get_resampling_step(len(timestamps), resampling_size)
+            timestamps = NWBReader._read_decimated(timestamps, step).astype(float)
         else:
-
-            timestamps = (time_series.rate) * np.arange(0, data_size) + time_series.starting_time
-            timestamps = timestamps.tolist()
+            # One timestamp per sample along the first axis, as the plottable data is resampled
+            data_size = len(time_series.data)
+            step = NWBReader._get_resampling_step(data_size, resampling_size)
+            # Single float allocation, scaled and shifted in place
+            timestamps = np.arange(0, data_size, step, dtype=float)
+            timestamps *= time_series.rate
+            timestamps += time_series.starting_time
         return timestamps
 
+    @staticmethod
+    def _get_resampling_step(size, resampling_size=None):
+        """Returns the stride that brings size samples down to at most resampling_size."""
+        if not resampling_size or size <= resampling_size:
+            return 1
+        return -(-size // resampling_size)
+
+    @staticmethod
+    def _read_decimated(data, step=1, shape=None):
+        """Returns every step-th element of data along the first axis.
+
+        Strided selections are very slow on chunked HDF5 datasets, so those are read a whole chunk at a time and
+        subsampled in memory instead. Pass shape when the caller already has it to spare the metadata lookup."""
+        if step == 1 or not isinstance(data, Dataset):
+            return data[::step]
+        chunks = data.chunks
+        if chunks is None:
+            return data[::step]
+        if shape is None:
+            shape = data.shape
+        length = shape[0]
+        chunk_size = chunks[0]
+        decimated = np.empty((-(-length // step),) + shape[1:], dtype=data.dtype)
+        index = offset = 0
+        while index < length:
+            # Read from the next selected sample to the end of the chunk holding it
+            chunk_end = min((index // chunk_size + 1) * chunk_size, length)
+            samples = data[index:chunk_end][::step]
+            decimated[offset:offset + len(samples)] = samples
+            offset += len(samples)
+            index += len(samples) * step
+        return decimated
+
     # @staticmethod
     # def get_timeseries_image_array(time_series):
     #     assert isinstance(time_series, ImageSeries)
     #     return NWBReader.get_raw_data(time_series.data)
 
-    # @staticmethod
-    # def get_raw_data(image_series_data):
-    #     """Given a image_series data object returns a NumPy array with the raw data."""
-    #     arr = np.zeros(image_series_data.shape, dtype=image_series_data.dtype)
-    #     return arr
+    @staticmethod
+    def get_raw_data(image_series_data, index=None):
+        """Given a image_series data object returns a NumPy array with the raw data.
+        When index is given only that frame is read."""
+        selection = () if index is None else index
+        if not isinstance(image_series_data, Dataset) or not image_series_data.size:
+            return image_series_data[selection]
+        shape = image_series_data.shape if index is None else image_series_data.shape[1:]
+        # read_direct overwrites the whole buffer, so there is no point in zeroing it first
+        arr = np.empty(shape, dtype=image_series_data.dtype)
+        image_series_data.read_direct(arr, source_sel=np.s_[selection])
+        return arr
 
     @staticmethod
     def get_mono_dimensional_timeseries_aux(values):
-        """Given a timeseries data object returns all mono dimensional timeserieses presents on it."""
+        """Given a timeseries data object returns all mono dimensional timeserieses presents on it, one per row."""
         assert isinstance(values, np.ndarray), "This function is supposed to work with numpy array data"
-        # Convert NaN to zeros FIXME if using data for anything else than plotting
-        mono_time_series_list = np.nan_to_num(values.transpose(), copy=False).astype(float, copy=False).tolist()
+        mono_time_series_array = NWBReader._sanitize(values)
         if len(values.shape) == 1:
-            mono_time_series_list = [mono_time_series_list]
-        return mono_time_series_list
+            mono_time_series_array = mono_time_series_array[np.newaxis]
+        return mono_time_series_array
+
+    @staticmethod
+    def _sanitize(values):
+        """Casts values to float into a new C-ordered buffer holding one mono dimensional series per row."""
+        # The cast and the transpose are done in a single copy, leaving the caller's array untouched
+        sanitized = np.empty(values.shape[::-1], dtype=float)
+        np.copyto(sanitized, values.transpose(), casting='unsafe')
+        return NWBReader._replace_non_finite(sanitized, values.dtype)
+
+    @staticmethod
+    def _replace_non_finite(sanitized, source_dtype):
+        """Replaces in place NaN and inf in a float array read from data of source_dtype."""
+        # Convert NaN to zeros FIXME if using data for anything else than plotting
+        # Integers cannot hold NaN or inf and any of them makes the sum non finite: in the common case where there is
+        # nothing to replace this costs one read only reduction instead of a write pass
+        if source_dtype.kind in 'biu':
+            return sanitized
+        # Large finite values can overflow the sum: that only costs a needless (and harmless) replacement pass
+        with np.errstate(over='ignore', invalid='ignore'):
+            all_finite = np.isfinite(sanitized.sum())
+        if not all_finite:
+            np.nan_to_num(sanitized, copy=False)
+        return sanitized
 
     # @staticmethod
     # def get_all_parents(element):
@@ -105,20 +233,41 @@ class NWBReader:
     # def get_timeseries_dimensions(time_series):
     #     return 1 if len(time_series.data.shape) == 1 else time_series.data.shape[0]
 
-    def __init__(self, nwbfile_or_path):
+    def __init__(self, nwbfile_or_path, plottable_cache_bytes=PLOTTABLE_CACHE_BYTES):
         if isinstance(nwbfile_or_path, str):
+            h5file = None
             try:
-
-
-                io = NWBHDF5IO(nwbfile_or_path, mode='r', load_namespaces=True)
+                h5file = h5py.File(nwbfile_or_path, 'r', rdcc_nbytes=HDF5_CHUNK_CACHE_BYTES,
+                                   rdcc_nslots=HDF5_CHUNK_CACHE_SLOTS)
+                io = NWBHDF5IO(nwbfile_or_path, mode='r', load_namespaces=True, file=h5file)
                 nwbfile = io.read()
             except Exception  as e:
+                if h5file is not None:
+                    h5file.close()
                 raise ValueError('Error reading the NWB file.', e.args)
         else:
+            io = None
             nwbfile = nwbfile_or_path
+        # Keep the io alive: the file is closed when it is garbage collected, and the data is read lazily from it
+        self.io = io
         self.nwbfile = nwbfile
         self.__data_interfaces = None
+        self.__data_interfaces_by_type = None
         self.__time_series_list = None
+        self.__io_pool = None
+        self.__plottable_cache = {}
+        self.__plottable_cache_bytes = 0
+        self.__plottable_cache_max_bytes = plottable_cache_bytes
+
+    def close(self):
+        """Stops the prefetch workers, releases the cached arrays and closes the file if the reader opened it."""
+        if self.__io_pool is not None:
+            self.__io_pool.shutdown()
+            self.__io_pool = None
+        self.clear_plottable_cache()
+        if self.io is not None:
+            self.io.close()
+            self.io = None
 
     def retrieve_from_path(self, path_pieces):
         '''Finds paths as extracted by `extract_time_series_path`'''
@@ -141,31 +290,41 @@ class NWBReader:
     #     return path
 
     def get_data_interfaces(self):
-        if not self.__data_interfaces:
-            self.__data_interfaces = self._get_data_interfaces(self.nwbfile)
+        if self.__data_interfaces is None:
+            self._get_data_interfaces()
         return self.__data_interfaces
 
-    def _get_data_interfaces(self, node):
-        """Given a NWBHDF5IO returns all the data_interfaces objects presents on it."""
+    def get_data_interfaces_by_type(self):
+        """Returns the data_interfaces grouped by neurodata_type."""
+        if self.__data_interfaces_by_type is None:
+            self._get_data_interfaces()
+        return self.__data_interfaces_by_type
+
+    def get_all_timeseries(self):
+        if self.__time_series_list is None:
+            self._get_data_interfaces()
+        return self.__time_series_list
+
+    def _get_data_interfaces(self):
+        """Collects all the data_interfaces objects presents in the nwbfile, together with the timeseries among them
+        and their grouping by neurodata_type, in a single walk."""
         data_interfaces_list = []
-        for child in node.children:
+        time_series_list = []
+        data_interfaces_by_type = defaultdict(list)
+        # Depth first with an explicit stack: children are pushed reversed to keep the document order
+        stack = list(reversed(self.nwbfile.children))
+        while stack:
+            child = stack.pop()
             if isinstance(child, NWBDataInterface):
                 data_interfaces_list.append(child)
-            data_interfaces_list += self._get_data_interfaces(child)
-        return data_interfaces_list
-
-    # def _get_timeseries(self):
-    #     """Given all the nwb_data_interfaces returns all of those that are timeseries objects."""
-    #     time_series_list = []
-    #     for data_interface in self.get_data_interfaces():
-    #         if isinstance(data_interface, TimeSeries):
-    #             time_series_list.append(data_interface)
-    #     return time_series_list
-
-    # def get_all_timeseries(self):
-    #     if not self.__time_series_list:
-    #         self.__time_series_list = self._get_timeseries()
-    #     return self.__time_series_list
+                data_interfaces_by_type[child.neurodata_type].append(child)
+                if isinstance(child, TimeSeries):
+                    time_series_list.append(child)
+            stack.extend(reversed(child.children))
+        self.__data_interfaces = data_interfaces_list
+        self.__time_series_list = time_series_list
+        # A plain dict: looking up a missing type must not add it
+        self.__data_interfaces_by_type = dict(data_interfaces_by_type)
 
     def get_nwbfile(self):
         return self.nwbfile
@@ -224,29 +383,25 @@ class NWBReader:
         """Given a full_path requirement gets the initial group and expands it blindly in search of the last path
         element """
         group = NWBReader.nwb_map_id_api.get(path_list[0])
-        if group is not None:
-            nodes = [getattr(self.nwbfile, group)]
-            for index, remaining_path in enumerate(path_list[1:]):
-                for node in nodes:
-                    if index == len(path_list) - 2:
-                        if isinstance(node, dict):
-                            for value in list(node.values()):
-                                if value.neurodata_type == remaining_path:
-                                    return True
-                        else:
-                            for child in node.children:
-                                if child.neurodata_type == remaining_path:
-                                    return True
-                    else:
-                        nodes = list(node.values()) if isinstance(node, dict) else node.children
-        return False
+        if group is None:
+            return False
+        nodes = [getattr(self.nwbfile, group)]
+        # Intermediate path elements are not matched: each one just expands all the nodes of the current level
+        for _ in path_list[1:-1]:
+            next_level = []
+            for node in nodes:
+                next_level.extend(NWBReader._get_node_children(node))
+            nodes = next_level
+        return any(child.neurodata_type == path_list[-1] for node in nodes
+                   for child in NWBReader._get_node_children(node))
+
+    @staticmethod
+    def _get_node_children(node):
+        return node.values() if isinstance(node, dict) else node.children
 
     def _check_requirement_data_interfaces(self, requirement):
         """Given a requirement looks for a match in all the nwb_data_interfaces of the nwb file """
-        for data_interfaces in self.get_data_interfaces():
-            if data_interfaces.neurodata_type == requirement:
-                return True
-        return False
+        return requirement in self.get_data_interfaces_by_type()
 
     # def get_all(self):
     #     return self.nwbfile.all_children()
@@ -290,10 +445,20 @@ class NWBReader:
                                 pass
                             np_image = imageio.imread(file_url)
                     else:
-                        np_image = pynwb_obj.data[()]
-                        if len(np_image.shape) > 3:
-                            np_image = np_image[index]
+                        if len(pynwb_obj.data.shape) > 3:
+                            # A stack of frames: read only the one requested, not the whole movie
+                            np_image = NWBReader.get_raw_data(pynwb_obj.data, index)
+                        else:
+                            np_image = NWBReader.get_raw_data(pynwb_obj.data)
 
                     return NWBReader.img_to_string(np_image)
 
         return None
+
+    def prefetch_image(self, name: str, interface: str, index: str):
+        """Starts reading and encoding an image in the background.
+        Returns a Future resolving to what `get_image` returns, so the next frame can be loaded while the current
+        one is being used."""
+        if self.__io_pool is None:
+            self.__io_pool = ThreadPoolExecutor(max_workers=IO_PREFETCH_WORKERS)
+        return self.__io_pool.submit(self.get_image, name, interface, index)
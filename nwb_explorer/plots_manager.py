@@ -115,8 +115,11 @@ class PlotManager: # pytest: no cover
             nwb_utils = NWBReader(nwbfile_path)
         except ValueError:
             raise ValueError("Invalid nwbfile")
-        available_plots = [{'name': plot['name'], 'id': plot['id']} for plot in self.plots if
-                           nwb_utils.has_all_requirements(plot["requirements"])]
+        try:
+            available_plots = [{'name': plot['name'], 'id': plot['id']} for plot in self.plots if
+                               nwb_utils.has_all_requirements(plot["requirements"])]
+        finally:
+            nwb_utils.close()
         return json.dumps(available_plots)
 
     def _get_public_plots(
@@ -1,6 +1,7 @@
 import traceback
 import pytest
 import os
+import numpy as np
 import pynwb
 from pygeppetto.model import CompositeType, StateVariableType, SimpleArrayType, ArrayType
 from pygeppetto.model.types import ImportType
@@ -198,6 +199,19 @@ def test_importValue(nwbfile):
     assert value.value[1] == 1.0
 
 
+def test_importValue_rows(nwbfile):
+    data = np.arange(40).reshape(10, 4) * 1.5
+    nwbfile.add_acquisition(pynwb.TimeSeries(name='multi', data=data, unit='pA', rate=2.0, conversion=2.0))
+    nwb_interpreter = NWBModelInterpreter(nwbfile)
+    model = nwb_interpreter.create_model()
+
+    import_main_type(model, nwb_interpreter)
+    for index in (0, 1):
+        var_to_import = pointer_utility.find_variable_from_path(model, f'nwbfile.acquisition.multi_row{index:02}.data')
+        value = nwb_interpreter.importValue(var_to_import.initialValues[0].value)
+        assert value.value == (data[:, index] * 2.0).tolist()
+
+
 def import_main_type(model, nwb_interpreter):
     typename = 'typename'
     # Import the main type
@@ -1,3 +1,9 @@
+import gc
+import os
+
+import h5py
+import numpy as np
+import pynwb
 import pytest
 
 from nwb_explorer.nwb_model_interpreter.nwb_reader import NWBReader
@@ -5,6 +11,8 @@ from .utils import create_nwb_file
 
 nwbfile = create_nwb_file()
 
+HERE = os.path.dirname(os.path.abspath(__file__))
+
 
 @pytest.fixture
 def uut():
@@ -14,6 +22,16 @@ def uut():
 
 
 
+def test_read_from_path():
+    reader = NWBReader(os.path.join(HERE, 'nwb_files', 'pynwb_test_files', 'test_TimeSeries.nwb'))
+    gc.collect()
+    ts = reader.get_nwbfile().acquisition['test_timeseries']
+    assert np.array_equal(reader.get_plottable_timeseries(ts), [np.arange(100, 200, 10)])
+    reader.close()
+    assert reader.io is None
+    assert not ts.data
+
+
 def test_retrieve_from_path(uut):
     ts = uut.retrieve_from_path(('acquisition', 't1'))
     assert ts != None
@@ -22,3 +40,123 @@ def test_retrieve_from_path(uut):
     ts = uut.retrieve_from_path(('processing', 'mod', 't3'))
     assert ts != None
     assert ts == nwbfile.modules['mod'].get_data_interface('t3')
+
+
+def test_get_plottable_timeseries_resampling(uut):
+    ts = nwbfile.acquisition['t1']
+    assert np.array_equal(uut.get_plottable_timeseries(ts), [ts.data])
+    assert np.array_equal(uut.get_plottable_timeseries(ts, resampling_size=10), [ts.data[::10]])
+    assert np.array_equal(uut.get_timeseries_timestamps(ts, resampling_size=10), ts.timestamps[::10])
+    assert len(uut.get_timeseries_timestamps(nwbfile.acquisition['t2'], resampling_size=30)) == 25
+    multi = pynwb.TimeSeries(name='multi', data=np.zeros((1000, 4)), unit='pA', rate=10.0, starting_time=2.0)
+    timestamps = uut.get_timeseries_timestamps(multi, resampling_size=100)
+    assert len(timestamps) == uut.get_plottable_timeseries(multi, resampling_size=100).shape[1] == 100
+    assert np.array_equal(timestamps, 10.0 * np.arange(0, 1000, 10) + 2.0)
+
+
+def test_get_plottable_timeseries_cache(uut):
+    ts = nwbfile.modules['mod']['t3']
+    # Mono dimensional series are imported once: nothing to share
+    assert uut.get_plottable_timeseries(ts) is not uut.get_plottable_timeseries(ts)
+    multi = pynwb.TimeSeries(name='multi', data=np.arange(30).reshape(10, 3), unit='pA', rate=1.0)
+    row = uut.get_plottable_timeseries_row(multi, 0)
+    assert not row.flags.writeable
+    assert uut.get_plottable_timeseries_row(multi, 1).base is row.base
+    assert uut.get_plottable_timeseries_row(multi, 1, resampling_size=5).base is not row.base
+    uut.clear_plottable_cache()
+    assert uut.get_plottable_timeseries_row(multi, 1).base is not row.base
+
+
+def test_get_plottable_timeseries_cache_bound():
+    data = np.arange(30).reshape(10, 3)
+    a, b, c = (pynwb.TimeSeries(name=name, data=data, unit='pA', rate=1.0) for name in 'abc')
+    # Room for the plottable arrays of two of them
+    reader = NWBReader(nwbfile, plottable_cache_bytes=2 * data.size * 8)
+    rows = {ts.name: reader.get_plottable_timeseries_row(ts, 0) for ts in (a, b, c)}
+    assert np.array_equal(rows['c'], [data[:, 0]])
+    # No room left for c: its channels are read one by one, the arrays of a and b stay
+    assert reader.get_plottable_timeseries_row(c, 1).base is not rows['c'].base
+    assert reader.get_plottable_timeseries_row(b, 1).base is rows['b'].base
+    for index in (1, 2):
+        assert reader.get_plottable_timeseries_row(a, index).base is rows['a'].base
+    # All the rows of a were imported, which makes room for c
+    row = reader.get_plottable_timeseries_row(c, 2)
+    assert reader.get_plottable_timeseries_row(c, 0).base is row.base
+    assert reader.get_plottable_timeseries_row(a, 0).base is not rows['a'].base
+
+
+def test_get_plottable_timeseries_from_dataset(tmpdir):
+    with h5py.File(str(tmpdir.join('mono.h5')), 'w') as f:
+        data = f.create_dataset('data', data=np.array([1.5, np.nan, 3.0]))
+        ts = pynwb.TimeSeries(name='mono', data=data, unit='pA', rate=1.0)
+        plottable = NWBReader.get_plottable_timeseries(ts)
+        assert plottable.dtype == np.float64
+        assert np.array_equal(plottable, [[1.5, 0.0, 3.0]])
+
+
+def test_get_plottable_timeseries_row(uut):
+    data = np.arange(30).reshape(10, 3)
+    ts = pynwb.TimeSeries(name='multi', data=data, unit='pA', rate=1.0)
+    for index in range(3):
+        assert np.array_equal(uut.get_plottable_timeseries_row(ts, index), [data[:, index]])
+    # Too big to be cached whole: each column is read on its own
+    reader = NWBReader(nwbfile, plottable_cache_bytes=len(data) * 8)
+    for index in range(3):
+        assert np.array_equal(reader.get_plottable_timeseries_row(ts, index), [data[:, index]])
+        assert np.array_equal(reader.get_plottable_timeseries_row(ts, index, resampling_size=5), [data[::2, index]])
+
+
+def test_read_decimated_chunked(tmpdir):
+    data = np.arange(1000, dtype=float)
+    with h5py.File(str(tmpdir.join('chunked.h5')), 'w') as f:
+        dataset = f.create_dataset('data', data=data, chunks=(64,))
+        for step in (1, 3, 64, 100, 999, 1000):
+            assert np.array_equal(NWBReader._read_decimated(dataset, step), data[::step])
+
+
+def test_get_mono_dimensional_timeseries_aux():
+    values = np.array([[1, np.nan], [3, 4]])
+    assert np.array_equal(NWBReader.get_mono_dimensional_timeseries_aux(values), [[1.0, 3.0], [0.0, 4.0]])
+    assert np.isnan(values[0, 1])
+    assert np.isfinite(NWBReader.get_mono_dimensional_timeseries_aux(np.array([np.inf, 1.0]))).all()
+    with np.errstate(all='raise'):
+        assert np.array_equal(NWBReader.get_mono_dimensional_timeseries_aux(np.array([1e308, 1e308])), [[1e308, 1e308]])
+    assert np.array_equal(NWBReader.get_mono_dimensional_timeseries_aux(np.arange(3)), [[0.0, 1.0, 2.0]])
+
+
+def test_has_all_requirements(uut):
+    assert uut.has_all_requirements(['TimeSeries', 'ImageSeries', 'ProcessingModule'])
+    assert not uut.has_all_requirements(['TimeSeries', 'TwoPhotonSeries'])
+    assert uut.has_all_requirements(['acquisition.ImageSeries', 'processing.mod.TimeSeries'])
+    assert not uut.has_all_requirements(['processing.mod.ImageSeries'])
+    assert not uut.has_all_requirements(['processing.mod.t3.TimeSeries'])
+    assert [ts.name for ts in uut.get_data_interfaces_by_type()['TimeSeries']] == ['t1', 't2', 't3', 't4']
+    with pytest.raises(KeyError):
+        uut.get_data_interfaces_by_type()['TwoPhotonSeries']
+    assert not uut.has_all_requirements(['TwoPhotonSeries'])
+
+
+def test_get_raw_data(tmpdir):
+    data = np.arange(24, dtype=np.uint8).reshape(2, 3, 4)
+    with h5py.File(str(tmpdir.join('raw.h5')), 'w') as f:
+        dataset = f.create_dataset('data', data=data)
+        assert np.array_equal(NWBReader.get_raw_data(dataset), data)
+        assert np.array_equal(NWBReader.get_raw_data(dataset, 1), data[1])
+        assert NWBReader.get_raw_data(f.create_dataset('empty', data=np.zeros((0, 3)))).shape == (0, 3)
+    assert np.array_equal(NWBReader.get_raw_data(data), data)
+
+
+def test_get_all_timeseries(uut):
+    assert [ts.name for ts in uut.get_all_timeseries()] == ['t1', 't2', 't3', 't4', 'internal_storaged_image',
+                                                            'external_storaged_image']
+    assert len(uut.get_data_interfaces()) == 7
+
+
+def test_prefetch_image(uut):
+    futures = [uut.prefetch_image('internal_storaged_image', 'acquisition', str(i)) for i in range(3)]
+    assert [future.result() for future in futures] == [
+        uut.get_image('internal_storaged_image', 'acquisition', str(i)) for i in range(3)]
+    # Closing waits for the prefetches in flight
+    future = uut.prefetch_image('internal_storaged_image', 'acquisition', '0')
+    uut.close()
+    assert future.done()